@@ -5,7 +5,7 @@ Mock Hytale Client for CI Testing
 Sends a Connect packet to verify server accepts F2P authentication.
 
 Usage:
-    python mock-client.py [--host HOST] [--port PORT] [--token TOKEN]
+    python mock-client.py [--host HOST] [--port PORT] [--token TOKEN] [--verbose]
 
 Protocol:
     - QUIC transport with ALPN "hytale/2"
@@ -16,11 +16,13 @@ Protocol:
 import argparse
 import asyncio
 import os
+import socket
 import struct
 import sys
 import tempfile
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from typing import List, Union
 
 try:
     from aioquic.asyncio import connect
@@ -36,7 +38,7 @@ try:
     from cryptography import x509
     from cryptography.x509.oid import NameOID
     from cryptography.hazmat.primitives import hashes, serialization
-    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.hazmat.primitives.asymmetric import ec
     from cryptography.hazmat.backends import default_backend
 except ImportError:
     print("[ERROR] cryptography not installed - required for client certificate")
@@ -62,19 +64,84 @@ PACKET_NAMES = {
     17: "PasswordRejected",
 }
 
+# Dense lookup table indexed by packet ID (None for unassigned IDs)
+_PACKET_NAME_LUT = tuple(PACKET_NAMES.get(i) for i in range(max(PACKET_NAMES) + 1))
+
 DEFAULT_PROTOCOL_CRC = 1789265863
 DEFAULT_PROTOCOL_BUILD_NUMBER = 2
 CLIENT_VERSION = "1.0.0"
 
+# Consumed receive-buffer bytes tolerated before compacting
+BUFFER_COMPACT_THRESHOLD = 64 * 1024
+
+# UDP socket buffer size requested for large AuthGrant responses (kernel may clamp it)
+SOCKET_BUFFER_SIZE = 4 << 20
+
+# Packet frame header: [4B length LE][4B packet ID LE]
+_FRAME = struct.Struct('<II')
+
+# Connect fixed block: nullBits, protocolCrc, protocolBuildNumber, clientVersion,
+# clientType, UUID, then 5 variable-block offsets (-1 = field absent)
+_CONNECT_FIXED_BLOCK = struct.Struct('<BiI20sB16siiiii')
+assert _CONNECT_FIXED_BLOCK.size == 66, f"Variable block should start at 66, got {_CONNECT_FIXED_BLOCK.size}"
+
+# Single-byte VarInts cover every username/language length and most tokens
+_SMALL_VARINTS = tuple(bytes((i,)) for i in range(0x80))
+
+# Client cert + key (one PEM file) is reused across runs; its identity does not matter for CI.
+# Kept in the per-user cache dir so other users can neither block nor plant it.
+CERT_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+    'hytale-mock-client')
+CERT_CACHE_FILE = os.path.join(CERT_CACHE_DIR, "client.pem")
+
+
+def _load_cached_cert():
+    """Return the cached cert+key PEM path if present, ECDSA and valid for at least a day."""
+    try:
+        with open(CERT_CACHE_FILE, 'rb') as f:
+            cert = x509.load_pem_x509_certificate(f.read())
+    except (OSError, ValueError):
+        return None
+
+    # Regenerate certs left by versions that used a key type the server may not accept
+    if not isinstance(cert.public_key(), ec.EllipticCurvePublicKey):
+        return None
+
+    # not_valid_after_utc needs cryptography 42+; older versions expose a naive UTC datetime
+    not_valid_after = getattr(cert, 'not_valid_after_utc', None)
+    if not_valid_after is None:
+        not_valid_after = cert.not_valid_after.replace(tzinfo=timezone.utc)
+
+    if not_valid_after <= datetime.now(timezone.utc) + timedelta(days=1):
+        return None
+
+    return CERT_CACHE_FILE
+
+
+def _write_atomic(path: str, data: bytes):
+    """Write data to path via a temp file + rename so readers never see partial PEMs."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
 
 def generate_self_signed_cert():
-    """Generate a self-signed client certificate for mTLS."""
-    private_key = rsa.generate_private_key(
-        public_exponent=65537,
-        key_size=2048,
-        backend=default_backend()
-    )
+    """Return the path of a self-signed client cert+key PEM for mTLS, generating it on cache miss."""
+    cached = _load_cached_cert()
+    if cached:
+        return cached
 
+    # P-256 keygen is far cheaper than RSA-2048, and unlike Ed25519 every TLS stack
+    # (including BoringSSL's default verify list) accepts it for client auth
+    private_key = ec.generate_private_key(ec.SECP256R1())
+
+    now = datetime.now(timezone.utc)
     subject = issuer = x509.Name([
         x509.NameAttribute(NameOID.COMMON_NAME, "HytaleMockClient"),
         x509.NameAttribute(NameOID.ORGANIZATION_NAME, "MockClient"),
@@ -86,47 +153,79 @@ def generate_self_signed_cert():
         .issuer_name(issuer)
         .public_key(private_key.public_key())
         .serial_number(x509.random_serial_number())
-        .not_valid_before(datetime.utcnow())
-        .not_valid_after(datetime.utcnow() + timedelta(days=365))
+        .not_valid_before(now)
+        .not_valid_after(now + timedelta(days=365))
         .sign(private_key, hashes.SHA256(), default_backend())
     )
 
-    cert_file = tempfile.NamedTemporaryFile(mode='wb', suffix='.pem', delete=False)
-    key_file = tempfile.NamedTemporaryFile(mode='wb', suffix='.pem', delete=False)
-
-    cert_file.write(cert.public_bytes(serialization.Encoding.PEM))
-    cert_file.close()
-
-    key_file.write(private_key.private_bytes(
+    # Cert followed by PKCS8 key, the combined layout load_cert_chain() accepts without a keyfile
+    pem = cert.public_bytes(serialization.Encoding.PEM) + private_key.private_bytes(
         encoding=serialization.Encoding.PEM,
-        format=serialization.PrivateFormat.TraditionalOpenSSL,
+        format=serialization.PrivateFormat.PKCS8,
         encryption_algorithm=serialization.NoEncryption()
-    ))
-    key_file.close()
+    )
+
+    try:
+        os.makedirs(CERT_CACHE_DIR, mode=0o700, exist_ok=True)
+        _write_atomic(CERT_CACHE_FILE, pem)
+        return CERT_CACHE_FILE
+    except OSError as e:
+        print(f"[WARN] Could not cache client certificate: {e}")
+
+    # Uncached fallback; test_connection removes it when done
+    with tempfile.NamedTemporaryFile(mode='wb', suffix='.pem', delete=False) as f:
+        f.write(pem)
+    return f.name
+
+
+def tune_socket_buffers(transport):
+    """Enlarge the UDP receive/send buffers beyond the small OS defaults."""
+    sock = transport.get_extra_info('socket') if transport else None
+    if sock is None:
+        return
+
+    for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, option, SOCKET_BUFFER_SIZE)
+        except OSError as e:
+            print(f"[WARN] Could not set socket buffer size: {e}")
+
 
-    return cert_file.name, key_file.name
+def get_packet_name(packet_id: int) -> str:
+    """Return the display name for a packet ID."""
+    if 0 <= packet_id < len(_PACKET_NAME_LUT):
+        name = _PACKET_NAME_LUT[packet_id]
+        if name:
+            return name
+    return f"Unknown({packet_id})"
 
 
 class HytalePacket:
     """Hytale packet encoding/decoding utilities."""
 
     @staticmethod
-    def encode_frame(packet_id: int, payload: bytes) -> bytes:
-        """Encode packet with frame header: [4B length LE][4B packet ID LE][payload]"""
-        header = struct.pack('<II', len(payload), packet_id)
-        return header + payload
+    def encode_frame_parts(packet_id: int, parts: List[Union[bytes, bytearray, memoryview]]) -> bytes:
+        """Encode packet from payload parts with frame header: [4B length LE][4B packet ID LE][payload]
+
+        Parts may be any bytes-like objects; header and parts are joined in one pass,
+        so each part is copied exactly once into the packet.
+        """
+        header = _FRAME.pack(sum(len(part) for part in parts), packet_id)
+        return b''.join([header, *parts])
 
     @staticmethod
-    def decode_frame(data: bytes) -> tuple:
-        """Decode packet frame, returns (packet_id, payload, remaining)."""
-        if len(data) < 8:
-            return None, None, data
+    def decode_frame(data, offset: int = 0) -> tuple:
+        """Decode packet frame at offset, returns (packet_id, payload, next_offset)."""
+        if len(data) - offset < 8:
+            return None, None, offset
 
-        length, packet_id = struct.unpack('<II', data[:8])
-        if len(data) < 8 + length:
-            return None, None, data
+        length, packet_id = _FRAME.unpack_from(data, offset)
+        start = offset + 8
+        end = start + length
+        if len(data) < end:
+            return None, None, offset
 
-        return packet_id, data[8:8+length], data[8+length:]
+        return packet_id, bytes(data[start:end]), end
 
 
 class ConnectPacket:
@@ -159,64 +258,67 @@ class ConnectPacket:
         self.client_version = client_version
         self.client_type = client_type
         self.language = language
+        # All inputs are fixed at construction, so encode once up front
+        self._encoded = self._encode_packet()
 
     def encode(self) -> bytes:
-        """Encode Connect packet payload."""
+        """Return the framed Connect packet."""
+        return self._encoded
+
+    def _encode_packet(self) -> bytes:
+        """Encode framed Connect packet."""
         null_bits = 0x01 if self.identity_token else 0
 
-        buf = bytearray()
-        buf.append(null_bits)
-        buf.extend(struct.pack('<i', self.protocol_crc))
-        buf.extend(struct.pack('<I', self.protocol_build))
-        buf.extend(self.client_version.encode('ascii')[:20].ljust(20, b'\x00'))
-        buf.append(self.client_type)
-        buf.extend(self.player_uuid.bytes)
-
-        # Offset placeholders (filled in later)
-        username_offset_pos = len(buf)
-        buf.extend(struct.pack('<I', 0))
-        identity_offset_pos = len(buf)
-        buf.extend(struct.pack('<I', 0))
-        language_offset_pos = len(buf)
-        buf.extend(struct.pack('<I', 0))
-        referral_data_offset_pos = len(buf)
-        buf.extend(struct.pack('<I', 0))
-        referral_source_offset_pos = len(buf)
-        buf.extend(struct.pack('<I', 0))
-
-        var_block_start = len(buf)
-        assert var_block_start == 66, f"Variable block should start at 66, got {var_block_start}"
-
-        # Username
-        struct.pack_into('<I', buf, username_offset_pos, len(buf) - var_block_start)
         username_bytes = self.username.encode('ascii')[:16]
-        buf.extend(self._encode_varint(len(username_bytes)))
-        buf.extend(username_bytes)
-
-        # Identity token (optional)
-        if self.identity_token:
-            struct.pack_into('<I', buf, identity_offset_pos, len(buf) - var_block_start)
-            token_bytes = self.identity_token.encode('utf-8')
-            buf.extend(self._encode_varint(len(token_bytes)))
-            buf.extend(token_bytes)
-        else:
-            struct.pack_into('<i', buf, identity_offset_pos, -1)
-
-        # Language
-        struct.pack_into('<I', buf, language_offset_pos, len(buf) - var_block_start)
+        token_bytes = self.identity_token.encode('utf-8') if self.identity_token else b''
         language_bytes = self.language.encode('ascii')[:16]
-        buf.extend(self._encode_varint(len(language_bytes)))
-        buf.extend(language_bytes)
 
-        # Unused optional fields
-        struct.pack_into('<i', buf, referral_data_offset_pos, -1)
-        struct.pack_into('<i', buf, referral_source_offset_pos, -1)
+        # Each variable field is [VarInt length][bytes]; offsets follow from the lengths
+        username_prefix = self._encode_varint(len(username_bytes))
+        token_prefix = self._encode_varint(len(token_bytes)) if self.identity_token else b''
+        language_prefix = self._encode_varint(len(language_bytes))
+
+        username_offset = 0
+        identity_start = len(username_prefix) + len(username_bytes)
+        identity_offset = identity_start if self.identity_token else -1
+        language_offset = identity_start + len(token_prefix) + len(token_bytes)
+
+        fixed_block = _CONNECT_FIXED_BLOCK.pack(
+            null_bits,
+            self.protocol_crc,
+            self.protocol_build,
+            self.client_version.encode('ascii')[:20].ljust(20, b'\x00'),
+            self.client_type,
+            self.player_uuid.bytes,
+            username_offset,
+            identity_offset,
+            language_offset,
+            -1,  # referralData (unused)
+            -1,  # referralSource (unused)
+        )
+
+        parts = [fixed_block, username_prefix, username_bytes]
+        if self.identity_token:
+            parts.append(token_prefix)
+            parts.append(token_bytes)
+        parts.append(language_prefix)
+        parts.append(language_bytes)
 
-        return HytalePacket.encode_frame(self.PACKET_ID, bytes(buf))
+        return HytalePacket.encode_frame_parts(self.PACKET_ID, parts)
 
     @staticmethod
     def _encode_varint(value: int) -> bytes:
         """Encode integer as VarInt"""
+        if value < 0x80:
+            return _SMALL_VARINTS[value]
+        if value < 0x4000:
+            return bytes(((value & 0x7F) | 0x80, value >> 7))
+        if value < 0x200000:
+            return bytes(((value & 0x7F) | 0x80, ((value >> 7) & 0x7F) | 0x80, value >> 14))
+        if value < 0x10000000:
+            return bytes(((value & 0x7F) | 0x80, ((value >> 7) & 0x7F) | 0x80,
+                          ((value >> 14) & 0x7F) | 0x80, value >> 21))
+
         result = bytearray()
         while (value & ~0x7F) != 0:
             result.append((value & 0x7F) | 0x80)
@@ -231,11 +333,11 @@ class MockClientProtocol(QuicConnectionProtocol):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.handshake_complete = asyncio.Event()
-        self.response_received = asyncio.Event()
-        self.response_packet_id = None
-        self.response_payload = None
+        # Resolved with (packet_id, payload) of the first frame, or (None, None) on termination
+        self.response = asyncio.get_running_loop().create_future()
         self.error = None
         self._buffer = bytearray()
+        self._offset = 0
 
     def quic_event_received(self, event):
         if isinstance(event, HandshakeCompleted):
@@ -249,33 +351,43 @@ class MockClientProtocol(QuicConnectionProtocol):
             reason = f", reason={event.reason_phrase}" if event.reason_phrase else ""
             self.error = f"Connection terminated: code={event.error_code}{reason}"
             print(f"[QUIC] {self.error}")
-            self.response_received.set()
+            if not self.response.done():
+                self.response.set_result((None, None))
 
     def _process_buffer(self):
         """Process received data buffer."""
-        while len(self._buffer) >= 8:
-            packet_id, payload, remaining = HytalePacket.decode_frame(bytes(self._buffer))
-            if packet_id is None:
-                break
+        # The view must be released before the buffer is resized below
+        with memoryview(self._buffer) as view:
+            while True:
+                packet_id, payload, self._offset = HytalePacket.decode_frame(view, self._offset)
+                if packet_id is None:
+                    break
+
+                if not self.response.done():
+                    self.response.set_result((packet_id, payload))
 
-            self._buffer = bytearray(remaining)
-            self.response_packet_id = packet_id
-            self.response_payload = payload
-            self.response_received.set()
+                packet_name = get_packet_name(packet_id)
+                print(f"[RECV] {packet_name} (ID: {packet_id}), payload: {len(payload)} bytes")
 
-            packet_name = PACKET_NAMES.get(packet_id, f"Unknown({packet_id})")
-            print(f"[RECV] {packet_name} (ID: {packet_id}), payload: {len(payload)} bytes")
+                if payload:
+                    hex_preview = payload[:64].hex() + ("..." if len(payload) > 64 else "")
+                    print(f"[RECV] Payload hex: {hex_preview}")
 
-            if payload:
-                hex_preview = payload[:64].hex() + ("..." if len(payload) > 64 else "")
-                print(f"[RECV] Payload hex: {hex_preview}")
+        # Drop consumed bytes only when everything was read or enough has piled up
+        if self._offset == len(self._buffer):
+            self._buffer.clear()
+            self._offset = 0
+        elif self._offset > BUFFER_COMPACT_THRESHOLD:
+            del self._buffer[:self._offset]
+            self._offset = 0
 
 
 async def test_connection(host: str, port: int, player_uuid: uuid.UUID,
                           username: str, identity_token: str = None,
                           timeout: float = 10.0,
                           protocol_crc: int = DEFAULT_PROTOCOL_CRC,
-                          protocol_build: int = DEFAULT_PROTOCOL_BUILD_NUMBER) -> dict:
+                          protocol_build: int = DEFAULT_PROTOCOL_BUILD_NUMBER,
+                          verbose: bool = False) -> dict:
     """Test server connection using QUIC with mTLS client certificate."""
     result = {
         "success": False,
@@ -289,13 +401,13 @@ async def test_connection(host: str, port: int, player_uuid: uuid.UUID,
         "error": None
     }
 
-    print("[INFO] Generating client certificate for mTLS...")
-    cert_file, key_file = generate_self_signed_cert()
+    print("[INFO] Loading client certificate for mTLS...")
+    cert_file = generate_self_signed_cert()
     print(f"[INFO] Client cert: {cert_file}")
 
     try:
         config = QuicConfiguration(is_client=True, alpn_protocols=["hytale/2"])
-        config.load_cert_chain(cert_file, key_file)
+        config.load_cert_chain(cert_file)
         config.verify_mode = False
 
         print(f"[INFO] QUIC config: ALPN={config.alpn_protocols}")
@@ -309,6 +421,7 @@ async def test_connection(host: str, port: int, player_uuid: uuid.UUID,
             create_protocol=MockClientProtocol,
         ) as protocol:
             protocol: MockClientProtocol
+            tune_socket_buffers(protocol._transport)
 
             # Wait for handshake
             print("[INFO] Waiting for QUIC handshake...")
@@ -331,7 +444,8 @@ async def test_connection(host: str, port: int, player_uuid: uuid.UUID,
 
             packet_data = connect_packet.encode()
             print(f"[SEND] Connect packet, size: {len(packet_data)} bytes")
-            print(f"[SEND] Payload hex: {packet_data.hex()[:128]}...")
+            if verbose:
+                print(f"[SEND] Payload hex: {packet_data[:64].hex()}...")
 
             # Open a bidirectional stream and send
             stream_id = protocol._quic.get_next_available_stream_id()
@@ -342,7 +456,7 @@ async def test_connection(host: str, port: int, player_uuid: uuid.UUID,
             # Wait for response
             print(f"[INFO] Waiting for server response (timeout: {timeout}s)...")
             try:
-                await asyncio.wait_for(protocol.response_received.wait(), timeout=timeout)
+                packet_id, payload = await asyncio.wait_for(protocol.response, timeout=timeout)
             except asyncio.TimeoutError:
                 result["error"] = f"Response timeout ({timeout}s) - server may have rejected silently"
                 return result
@@ -351,8 +465,7 @@ async def test_connection(host: str, port: int, player_uuid: uuid.UUID,
                 result["error"] = protocol.error
                 return result
 
-            packet_id = protocol.response_packet_id
-            packet_name = PACKET_NAMES.get(packet_id, f"Unknown({packet_id})")
+            packet_name = get_packet_name(packet_id)
             result["response_packet"] = packet_id
             result["response_name"] = packet_name
 
@@ -364,8 +477,8 @@ async def test_connection(host: str, port: int, player_uuid: uuid.UUID,
                 result["message"] = "Server sent AuthGrant - authenticated mode working"
             elif packet_id == PACKET_DISCONNECT:
                 result["error"] = "Server rejected connection (Disconnect packet)"
-                if protocol.response_payload:
-                    result["disconnect_payload"] = protocol.response_payload.hex()
+                if payload:
+                    result["disconnect_payload"] = payload.hex()
             else:
                 result["success"] = True
                 result["message"] = f"Received {packet_name} (ID: {packet_id})"
@@ -382,9 +495,8 @@ async def test_connection(host: str, port: int, player_uuid: uuid.UUID,
         traceback.print_exc()
         return result
     finally:
-        for path in (cert_file, key_file):
-            if path and os.path.exists(path):
-                os.unlink(path)
+        if cert_file != CERT_CACHE_FILE and os.path.exists(cert_file):
+            os.unlink(cert_file)
 
 
 def main():
@@ -402,6 +514,7 @@ def main():
     parser.add_argument("--protocol-build", type=int,
                         default=int(os.environ.get('PROTOCOL_BUILD', str(DEFAULT_PROTOCOL_BUILD_NUMBER))),
                         help="Protocol build number (or set PROTOCOL_BUILD env var)")
+    parser.add_argument("--verbose", action="store_true", help="Print hex dump of the sent Connect packet")
     args = parser.parse_args()
 
     player_uuid = uuid.UUID(args.uuid) if args.uuid else uuid.uuid4()
@@ -425,10 +538,17 @@ def main():
     print("=" * 60)
     print()
 
-    result = asyncio.run(test_connection(
+    # uvloop is optional; it trims per-datagram and timer overhead in the QUIC exchange
+    try:
+        import uvloop
+        run = getattr(uvloop, 'run', asyncio.run)  # uvloop.run() needs uvloop 0.18+
+    except ImportError:
+        run = asyncio.run
+
+    result = run(test_connection(
         args.host, args.port, player_uuid,
         args.username, identity_token, args.timeout,
-        args.protocol_crc, args.protocol_build
+        args.protocol_crc, args.protocol_build, args.verbose
     ))
 
     print()